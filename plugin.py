@@ -1,23 +1,26 @@
 from __future__ import annotations
-from collections import defaultdict
+from bisect import bisect_left, bisect_right
 from contextlib import contextmanager
 from functools import partial
-from itertools import chain, tee
+import hashlib
 import re
+import traceback
 
 import sublime
 import sublime_plugin
 
 from typing import (
-    Callable, DefaultDict, Dict, Iterable, Iterator, List, Literal,
-    Optional, Tuple, TypeVar, Union,
+    Callable, Dict, Final, Hashable, Iterator, List, Literal,
+    Optional, Set, Tuple, Union,
 )
-T = TypeVar("T")
 LoadedCallback = Callable[[sublime.View], None]
+Handlers = Dict[int, Dict[Hashable, LoadedCallback]]
 
-filter_: Callable[[Iterable[Optional[T]]], Iterator[T]] = partial(filter, None)
-
-SEARCH_INFO_RE = re.compile(r'(?:"(?P<pattern>.+)")(?: \((?P<flags>.+)\))?')
+SEARCH_HEADER: Final = r"^Searching \d+ files"
+UNINDENTED_LINE: Final = r"^\S"
+FILENAME_SELECTOR: Final = "entity.name.filename.find-in-files"
+RESULT_LINE_RE: Final = re.compile(r"^ +([0-9]+)", re.ASCII)
+SEARCH_INFO_RE: Final = re.compile(r'(?:"(?P<pattern>.+)")(?: \((?P<flags>.+)\))?')
 FLAG_TRANSLATIONS = {
     "regex": "regex",
     "case sensitive": "case_sensitive",
@@ -67,27 +70,26 @@ class fif_addon_refresh_last_search(sublime_plugin.TextCommand):
         pause=False
     ):
         view = self.view
-        try:
-            last_search_start = view.find_all(r"^Searching \d+ files")[-1]
-        except IndexError:
+        last_search_start = find_last_search_start(view)
+        if not last_search_start:
             return
 
         search_headline_span = view.line(last_search_start.a)
         search_info = view.substr(search_headline_span)
-        if (match := SEARCH_INFO_RE.search(search_info)):
-            used_flags = set(
+        if '"' in search_info and (match := SEARCH_INFO_RE.search(search_info)):
+            used_flags = {
                 FLAG_TRANSLATIONS[user_friendly_flag]
                 for user_friendly_flag in flags.split(", ")
-            ) if (flags := match.group("flags")) else {}
+            } if (flags := match.group("flags")) else frozenset()
             options = {
                 "pattern": match.group("pattern"),
                 **{
                     flag: (flag not in used_flags) if toggle else (flag in used_flags)
-                    for flag, toggle in {
+                    for flag, toggle in (
                         ("case_sensitive", toggle_case_sensitive),
                         ("regex", toggle_regex),
                         ("whole_word", toggle_whole_word)
-                    }
+                    )
                 }
             }
             if toggle_regex:
@@ -107,18 +109,19 @@ class fif_addon_refresh_last_search(sublime_plugin.TextCommand):
         if pause:
             return
 
-        previous_result = view.substr(sublime.Region(search_headline_span.b, view.size()))
+        previous_digest = digest_region(view, sublime.Region(search_headline_span.b, view.size()))
         cursor = view.sel()[0].a
         offset = y_offset(view, cursor)
         row, col = view.rowcol(cursor)
         top_row, _ = view.rowcol(last_search_start.a)
-        position = read_position(view)
+        position = read_position(view, last_search_start)
         last_search_output_span = sublime.Region(
             max(0, last_search_start.a - 2),  # "-2" => also delete two preceding newlines
             view.size()
         )
 
         view.replace(edit, last_search_output_span, "")
+        await_search_starting_at(view, last_search_output_span.a)
         with modified_context_lines_setting(view):
             window.run_command("find_all")
         window.run_command("focus_panel", {"name": "find_results"})
@@ -134,9 +137,13 @@ class fif_addon_refresh_last_search(sublime_plugin.TextCommand):
                 col=col,
                 position_description=position
             )
-            on_search_finished(view, restore_previous_cursor_)
+            on_search_finished(view, restore_previous_cursor_, key="restore_previous_cursor")
 
-        on_search_finished(view, partial(check_if_result_changed, previous_result=previous_result))
+        on_search_finished(
+            view,
+            partial(check_if_result_changed, previous_digest=previous_digest),
+            key="check_if_result_changed"
+        )
 
 
 def y_offset(view, cursor):
@@ -153,20 +160,14 @@ def apply_offset(view: sublime.View, cursor: int, offset: float) -> None:
     view.set_viewport_position((vx, vy), animate=False)
 
 
-def read_position(view: sublime.View):
+def read_position(view: sublime.View, last_search_start: Optional[sublime.Region] = None):
     cursor = view.sel()[0].a
-    try:
-        last_search_start = view.find_all(r"^Searching \d+ files")[-1]
-    except IndexError:
-        last_search_start = sublime.Region(0)
+    if last_search_start is None:
+        last_search_start = find_last_search_start(view) or sublime.Region(0)
 
     filename = None
-    for r in reversed(view.find_by_selector("entity.name.filename.find-in-files")):
-        if r.a < last_search_start.a:
-            break
-        if r.a <= cursor:
-            filename = view.substr(r)
-            break
+    if (r := nearest_filename_before(view, cursor, last_search_start.a)):
+        filename = view.substr(r)
 
     line_candidates = []
     full_line = full_line_content_at(view, cursor)
@@ -175,17 +176,80 @@ def read_position(view: sublime.View):
         if (offset := column_offset_at(view, cursor)):
             line_candidates.append(full_line[offset:])
 
-    for r in reversed(view.get_regions("match")):
-        if r.a < last_search_start.a:
-            break
-        if r.a <= cursor:
-            nearest_match = full_line_content_at(view, r.a)
-            line_candidates.append(nearest_match)
-            if (offset := column_offset_at(view, r.a)):
-                line_candidates.append(nearest_match[offset:])
-            break
+    regions, begins, _ = match_regions(view)
+    idx = bisect_right(begins, cursor) - 1
+    if idx >= 0 and begins[idx] >= last_search_start.a:
+        r = regions[idx]
+        nearest_match = full_line_content_at(view, r.a)
+        line_candidates.append(nearest_match)
+        if (offset := column_offset_at(view, r.a)):
+            line_candidates.append(nearest_match[offset:])
+
+    return (filename, [line for line in line_candidates if line])
 
-    return (filename, list(filter_(line_candidates)))
+
+_last_search_start_cache: Dict[int, Tuple[int, Optional[sublime.Region]]] = {}
+
+
+def find_last_search_start(view: sublime.View) -> Optional[sublime.Region]:
+    # Search backwards from the end so that we only ever get the *last*
+    # headline without materializing every previous one.  Handlers running
+    # after the same search ask repeatedly, so remember the answer for the
+    # current change count.
+    change_count = view.change_count()
+    cached = _last_search_start_cache.get(view.id())
+    if cached and cached[0] == change_count:
+        return cached[1]
+
+    region = view.find(
+        SEARCH_HEADER,
+        view.size(),
+        sublime.FindFlags.REVERSE  # type: ignore[attr-defined]
+    )
+    rv = region or None
+    _last_search_start_cache[view.id()] = (change_count, rv)
+    return rv
+
+
+MatchRegions = Tuple[List[sublime.Region], List[int], List[int]]
+_match_regions_cache: Dict[int, Tuple[int, MatchRegions]] = {}
+
+
+def match_regions(view: sublime.View) -> MatchRegions:
+    # Return the "match" regions together with their begins and ends.  The
+    # regions are sorted, so we can `bisect` into these.  Sublime only adds
+    # them together with the text, so consecutive navigation commands can
+    # share the same lists as long as the change count is the same.
+    change_count = view.change_count()
+    cached = _match_regions_cache.get(view.id())
+    if cached and cached[0] == change_count:
+        return cached[1]
+
+    regions = view.get_regions("match")
+    rv = (regions, [r.begin() for r in regions], [r.end() for r in regions])
+    _match_regions_cache[view.id()] = (change_count, rv)
+    return rv
+
+
+def nearest_filename_before(view: sublime.View, pt: int, stop: int) -> Optional[sublime.Region]:
+    # Filenames are the only unindented lines in the result body.  Hop
+    # backwards from one such line to the previous one instead of asking
+    # for *all* filename regions of the whole buffer.
+    if pt < stop:
+        return None
+    pt = view.line(pt).b
+    while pt >= stop:
+        r = view.find(
+            UNINDENTED_LINE,
+            pt,
+            sublime.FindFlags.REVERSE  # type: ignore[attr-defined]
+        )
+        if not r or r.a < stop:
+            return None
+        if view.match_selector(r.a, FILENAME_SELECTOR):
+            return view.expand_to_scope(r.a, FILENAME_SELECTOR)
+        pt = r.a - 1
+    return None
 
 
 def full_line_content_at(view: sublime.View, pt: int) -> str:
@@ -253,55 +317,53 @@ class ContextLineInjector(sublime_plugin.EventListener):
 
 
 def fix_leading_newlines(view):
-    # We just modify the cursor as Sublime Text uses `append` for drawing
-    set_sel(view, [sublime.Region(0)])
-    view.run_command("right_delete")
-    view.run_command("right_delete")
+    replace_view_content(view, "", sublime.Region(0, 2))
 
 
-def check_if_result_changed(view, previous_result):
+def check_if_result_changed(view, previous_digest):
     window = view.window()
     if not window:
         return
-    try:
-        last_search_start = view.find_all(r"^Searching \d+ files")[-1]
-    except IndexError:
+    last_search_start = find_last_search_start(view)
+    if not last_search_start:
         return
 
     search_headline_span = view.line(last_search_start.a)
-    this_result = view.substr(sublime.Region(search_headline_span.b, view.size()))
-    if this_result == previous_result:
+    this_digest = digest_region(view, sublime.Region(search_headline_span.b, view.size()))
+    if this_digest == previous_digest:
         window.status_message("Search result already up-to-date.")
 
 
+def digest_region(view: sublime.View, region: sublime.Region, chunk_size=65536) -> bytes:
+    # Hash the region in chunks so that we never hold a copy of a possibly
+    # huge search result in memory.
+    h = hashlib.blake2b(digest_size=16)
+    for offset in range(region.a, region.b, chunk_size):
+        chunk = view.substr(sublime.Region(offset, min(offset + chunk_size, region.b)))
+        h.update(chunk.encode())
+    return h.digest()
+
+
 def restore_previous_cursor(view: sublime.View, row_offset, col, position_description):
-    try:
-        last_search_start = view.find_all(r"^Searching \d+ files")[-1]
-    except IndexError:
+    last_search_start = find_last_search_start(view)
+    if not last_search_start:
         return
 
     start, end = last_search_start.a, view.size()
     filename, line_candidates = position_description
     if filename:
-        try:
-            start, end = next(
-                (r.a, p.a)
-                for p, r in pairwise(chain(
-                    [sublime.Region(view.size())],
-                    reversed(view.find_by_selector("entity.name.filename.find-in-files"))
-                ))
-                if start <= r.a < end
-                if view.substr(r) == filename
-            )
-        except StopIteration:
-            pass
+        next_filename_start = end
+        while (r := nearest_filename_before(view, next_filename_start - 1, start)):
+            if view.substr(r) == filename:
+                start, end = r.a, next_filename_start
+                break
+            next_filename_start = r.a
 
     try:
         start = next(
             r.a
             for line in line_candidates
-            for r in view.find_all(line, sublime.LITERAL)
-            if start <= r.a < end
+            for r in find_all_within(view, line, start, end)
             if full_line_content_at(view, r.a).endswith(line)
         )
     except StopIteration:
@@ -312,9 +374,18 @@ def restore_previous_cursor(view: sublime.View, row_offset, col, position_descri
     view.run_command("fif_addon_set_cursor", {"cursor": cursor_now, "offset": row_offset})
 
 
+def find_all_within(view: sublime.View, needle: str, start: int, end: int) -> Iterator[sublime.Region]:
+    # Like `view.find_all(needle, sublime.LITERAL)` but lazy and bounded to
+    # the search result we're interested in.
+    pt = start
+    while (r := view.find(needle, pt, sublime.LITERAL)) and r.a < end:
+        yield r
+        pt = r.b
+
+
 class fif_addon_set_cursor(sublime_plugin.TextCommand):
     def run(self, edit, cursor, offset):
-        set_sel(self.view, [sublime.Region(cursor)])
+        set_sel(self.view, sublime.Region(cursor))
         apply_offset(self.view, cursor, offset)
 
 
@@ -331,120 +402,191 @@ def replace_view_content(view, text, region: Union[int, sublime.Region]) -> None
     view.run_command("fif_addon_replace_text", {"text": text, "region": region_})
 
 
-SEARCH_SUMMARY_RE = re.compile(r"\d+ match(es)? .*")
-_on_search_finished: DefaultDict[sublime.View, List[LoadedCallback]] = defaultdict(list)
+SEARCH_SUMMARY_RE: Final = re.compile(r"\d+ matches? ", re.ASCII)
+_on_search_finished: Handlers = {}
+
 
+def on_search_finished(view: sublime.View, fn: LoadedCallback, key: Optional[Hashable] = None) -> None:
+    # A handler registered under the `key` of a still pending one replaces
+    # it, e.g. when the user hits `[F5]` repeatedly.
+    _on_search_finished.setdefault(view.id(), {})[fn if key is None else key] = fn
 
-def on_search_finished(view: sublime.View, fn: LoadedCallback) -> None:
-    _on_search_finished[view].append(fn)
+
+def is_find_results_view(view: sublime.View) -> bool:
+    return view.match_selector(0, "text.find-in-files")
 
 
 class fif_addon_wait_for_search_to_be_done_listener(sublime_plugin.EventListener):
+    pending_checks: Set[int] = set()
+    awaited_search_starts: Dict[int, int] = {}
+
     def is_applicable(self, view):
-        syntax = view.settings().get("syntax")
-        return syntax.endswith("Find Results.hidden-tmLanguage") if syntax else False
+        return is_find_results_view(view)
 
     def on_modified(self, view):
         if self.is_applicable(view):
-            text = view.substr(view.line(view.size() - 1))
-            if SEARCH_SUMMARY_RE.search(text) is None:
+            # Sublime appends the results in many small chunks.  Look at
+            # the buffer at most once per tick.
+            vid = view.id()
+            if vid in self.pending_checks:
+                return
+            self.pending_checks.add(vid)
+            sublime.set_timeout(partial(self.check_for_summary, view))
+
+    def check_for_summary(self, view):
+        vid = view.id()
+        self.pending_checks.discard(vid)
+        if not view.is_valid():
+            return
+
+        # Peek at the end of the buffer only; the summary line is short.
+        size = view.size()
+        tail = view.substr(sublime.Region(max(0, size - 256), size))
+        if "match" not in tail:
+            return
+
+        _, nl, text = (tail[:-1] if tail.endswith("\n") else tail).rpartition("\n")
+        if not nl and size > 256:
+            # the last line is longer than our tail
+            return
+        if SEARCH_SUMMARY_RE.match(text) is None:
+            return
+
+        update_searching_headline(view, text)
+
+        awaited_start = self.awaited_search_starts.get(vid)
+        if awaited_start is not None:
+            last_search_start = find_last_search_start(view)
+            if not last_search_start or last_search_start.a < awaited_start:
                 return
+            del self.awaited_search_starts[vid]
+        run_handlers(view, _on_search_finished)
+
+    def on_pre_close(self, view):
+        self.pending_checks.discard(view.id())
+        self.awaited_search_starts.pop(view.id(), None)
+        _on_search_finished.pop(view.id(), None)
+
 
-            update_searching_headline(view, text)
-            run_handlers(view, _on_search_finished)
+def await_search_starting_at(view: sublime.View, pt: int) -> None:
+    # Since we check for the summary deferred, the check may see the buffer
+    # right after we've deleted the last search.  Then the summary of the
+    # search before it is the last line, and we must not take it for the end
+    # of the refresh.  Only the caller knows where the new search will start,
+    # so it has to tell the listener.
+    fif_addon_wait_for_search_to_be_done_listener.awaited_search_starts[view.id()] = pt
 
 
 def update_searching_headline(view, text):
     if text.startswith("0"):
         return
 
-    last_search_start = view.find(
-        r"^Searching \d+ files .*",
-        view.size(),
-        sublime.FindFlags.REVERSE  # type: ignore[attr-defined]
-    )
-    if view.substr(last_search_start).endswith(text):
+    last_search_start = find_last_search_start(view)
+    if not last_search_start:
         return
 
-    replace_view_content(view, f", {text}", last_search_start.b)
+    search_headline_span = view.line(last_search_start.a)
+    if view.substr(search_headline_span).endswith(text):
+        return
+
+    replace_view_content(view, f", {text}", search_headline_span.b)
 
 
 class fif_addon_listener(sublime_plugin.EventListener):
-    previous_views: Dict[sublime.Window, sublime.View] = {}
-    change_counts_by_window: Dict[sublime.Window, int] = {}
-    handle_modified_events: Dict[sublime.Window, bool] = {}
+    # All state is keyed by `window.id()` so that we never hold on to
+    # `sublime.Window` objects of closed windows.
+    previous_views: Dict[int, sublime.View] = {}
+    change_counts_by_window: Dict[int, int] = {}
+    handle_modified_events: Dict[int, bool] = {}
 
     def is_applicable(self, view):
-        syntax = view.settings().get("syntax")
-        return syntax.endswith("Find Results.hidden-tmLanguage") if syntax else False
+        return is_find_results_view(view)
 
     def on_activated_async(self, view):
         if self.is_applicable(view):
-            view.settings().set("result_line_regex", "^ +([0-9]+)")
+            settings = view.settings()
+            if settings.get("result_line_regex") != RESULT_LINE_RE.pattern:
+                settings.set("result_line_regex", RESULT_LINE_RE.pattern)
 
-            current_cc = view.change_count()
             window = view.window()
-            self.handle_modified_events[window] = True
-            previous_cc = self.change_counts_by_window.get(window)
+            if not window:
+                return
+            wid = window.id()
+            current_cc = view.change_count()
+            self.handle_modified_events[wid] = True
+            previous_cc = self.change_counts_by_window.get(wid)
             if previous_cc != current_cc:
-                self.change_counts_by_window[window] = current_cc
-                previous_view = self.previous_views.get(window)
+                self.change_counts_by_window[wid] = current_cc
+                previous_view = self.previous_views.get(wid)
                 if previous_view:
                     place_view(window, view, previous_view)
 
     def on_modified_async(self, view):
         if self.is_applicable(view):
             window = view.window()
-            if self.handle_modified_events.get(window):
+            if window and self.handle_modified_events.get(window.id()):
                 current_cc = view.change_count()
-                self.change_counts_by_window[window] = current_cc
+                self.change_counts_by_window[window.id()] = current_cc
 
     def on_pre_close(self, view):
         if self.is_applicable(view):
             window = view.window()
-            self.change_counts_by_window.pop(window, None)
-            self.previous_views.pop(window, None)
-            self.handle_modified_events.pop(window, None)
+            if window:
+                self.forget_window(window.id())
+        _match_regions_cache.pop(view.id(), None)
+        _last_search_start_cache.pop(view.id(), None)
+
+    def on_pre_close_window(self, window):
+        self.forget_window(window.id())
 
     def on_deactivated(self, view):
+        window = view.window()
+        if not window:
+            return
+
         if view.element() is None:
-            window = view.window()
-            self.previous_views[window] = view
+            self.previous_views[window.id()] = view
 
         if self.is_applicable(view):
-            window = view.window()
-            self.handle_modified_events[window] = False
+            self.handle_modified_events[window.id()] = False
+
+    def forget_window(self, wid: int) -> None:
+        self.change_counts_by_window.pop(wid, None)
+        self.previous_views.pop(wid, None)
+        self.handle_modified_events.pop(wid, None)
 
 
 def place_view(window: sublime.Window, view: sublime.View, after: sublime.View) -> None:
+    if after.window() != window:
+        return
     view_group, current_index = window.get_view_index(view)
     if current_index == -1:
         return
     group, index = window.get_view_index(after)
     if view_group == group:
         wanted_index = index + 1 if index < current_index else index
-        window.set_view_index(view, group, wanted_index)
+        if wanted_index != current_index:
+            window.set_view_index(view, group, wanted_index)
 
 
 class fif_addon_next_match(sublime_plugin.TextCommand):
     def run(self, edit):
         def carets(view):
             yield view.sel()[0].b
-            try:
-                yield view.find_all(r"^Searching \d+ files")[-1].a
-            except IndexError:
-                return
+            if (last_search_start := find_last_search_start(view)):
+                yield last_search_start.a
 
         view = self.view
-        regions = view.get_regions("match")
+        regions, begins, _ = match_regions(view)
         for caret in carets(view):
-            for r in regions:
-                if r.begin() > caret:
-                    set_sel(view, [r])
-                    view.show(r, True)
-                    if preview_is_open(view):
-                        view.run_command("fif_addon_goto", {"preview": True})
-                    return
+            idx = bisect_right(begins, caret)
+            if idx < len(regions):
+                r = regions[idx]
+                set_sel(view, r)
+                view.show(r, True)
+                if preview_is_open(view):
+                    view.run_command("fif_addon_goto", {"preview": True})
+                return
 
 
 class fif_addon_prev_match(sublime_plugin.TextCommand):
@@ -454,15 +596,16 @@ class fif_addon_prev_match(sublime_plugin.TextCommand):
             yield view.size()
 
         view = self.view
-        regions = view.get_regions("match")
+        regions, _, ends = match_regions(view)
         for caret in carets(view):
-            for r in reversed(regions):
-                if r.end() < caret:
-                    set_sel(view, [r])
-                    view.show(r, True)
-                    if preview_is_open(view):
-                        view.run_command("fif_addon_goto", {"preview": True})
-                    return
+            idx = bisect_left(ends, caret) - 1
+            if idx >= 0:
+                r = regions[idx]
+                set_sel(view, r)
+                view.show(r, True)
+                if preview_is_open(view):
+                    view.run_command("fif_addon_goto", {"preview": True})
+                return
 
 
 class fif_addon_goto(sublime_plugin.TextCommand):
@@ -487,7 +630,7 @@ class fif_addon_goto(sublime_plugin.TextCommand):
         column_offset = column_offset_at(view, cursor)
         col = max(0, c - column_offset)
         s = view.sel()[0]
-        count_line_breaks = len(view.lines(s)) - 1
+        count_line_breaks = view.rowcol(s.end())[0] - view.rowcol(s.begin())[0]
         len_s = s.b - s.a
         if len_s < 0:
             len_s += count_line_breaks * column_offset
@@ -515,7 +658,7 @@ class fif_addon_goto(sublime_plugin.TextCommand):
             if view_:
                 def carry_selection_to_view(view):
                     caret_ = caret(view) + col
-                    set_sel(view, [sublime.Region(caret_ - len_s, caret_)])
+                    set_sel(view, sublime.Region(caret_ - len_s, caret_))
 
                 def carry_selection_to_view_deferred(view):
                     sublime.set_timeout(partial(carry_selection_to_view, view))
@@ -574,13 +717,12 @@ def preview_is_open(view: sublime.View) -> bool:
     return len(selected_sheets) == 2 and view.sheet() in selected_sheets
 
 
-VIEWS_YET_TO_BE_LOADED: DefaultDict[sublime.View, List[LoadedCallback]] \
-    = defaultdict(list)
+VIEWS_YET_TO_BE_LOADED: Handlers = {}
 
 
 def when_loaded(view: sublime.View, kont: LoadedCallback) -> None:
     if view.is_loading():
-        VIEWS_YET_TO_BE_LOADED[view].append(kont)
+        VIEWS_YET_TO_BE_LOADED.setdefault(view.id(), {})[kont] = kont
     else:
         kont(view)
 
@@ -589,22 +731,35 @@ class fif_addon_await_loading_views(sublime_plugin.EventListener):
     def on_load(self, view):
         run_handlers(view, VIEWS_YET_TO_BE_LOADED)
 
+    def on_pre_close(self, view):
+        VIEWS_YET_TO_BE_LOADED.pop(view.id(), None)
 
-def run_handlers(view, storage: Dict[sublime.View, List[LoadedCallback]]):
-    try:
-        fns = storage.pop(view)
-    except KeyError:
+
+def run_handlers(view, storage: Handlers):
+    fns = storage.pop(view.id(), None)
+    if not fns:
         return
 
-    for fn in fns:
-        sublime.set_timeout(partial(fn, view))
+    def run_all():
+        for fn in fns.values():
+            # Don't let one failing handler swallow the ones after it.
+            try:
+                fn(view)
+            except Exception:
+                traceback.print_exc()
+
+    # Schedule all handlers at once, in order, instead of one timer each.
+    sublime.set_timeout(run_all)
 
 
 @contextmanager
 def restore_selection(view: sublime.View):
-    frozen_sel = [s for s in view.sel()]
-    yield
-    set_sel(view, frozen_sel)
+    sel = view.sel()
+    frozen_sel = sel[0] if len(sel) == 1 else list(sel)
+    try:
+        yield
+    finally:
+        set_sel(view, frozen_sel)
 
 
 def caret(view: sublime.View) -> int:
@@ -612,22 +767,34 @@ def caret(view: sublime.View) -> int:
 
 
 def column_offset_at(view: sublime.View, pt: int) -> int:
+    # Result lines start with the right-aligned line number, e.g. "  12: ",
+    # so just look at the very beginning of the line.
     line_region = view.line(pt)
-    for r, scope in view.extract_tokens_with_scopes(line_region):
+    prefix = view.substr(
+        sublime.Region(line_region.a, min(line_region.a + 16, line_region.b)))
+    if (match := RESULT_LINE_RE.match(prefix)):
+        return match.end() + 2  # 2 spaces or `: `
+    elif prefix.startswith(" "):
+        # An indented line of unusual shape, e.g. from a customized syntax.
+        # Ask the syntax for the line number.
+        return column_offset_from_scopes(view, line_region)
+    else:
+        return 0
+
+
+def column_offset_from_scopes(view: sublime.View, line_region: sublime.Region) -> int:
+    # The line number is always among the first tokens of a line.
+    for r, scope in view.extract_tokens_with_scopes(line_region)[:3]:
         if "constant.numeric.line-number." in scope:
             return r.b + 2 - line_region.a  # 2 spaces or `: `
     else:
         return 0
 
 
-def set_sel(view: sublime.View, selection: List[sublime.Region]) -> None:
+def set_sel(view: sublime.View, selection: Union[sublime.Region, List[sublime.Region]]) -> None:
     sel = view.sel()
     sel.clear()
-    sel.add_all(selection)
-
-
-def pairwise(iterable: Iterable[T]) -> Iterable[tuple[T, T]]:
-    "s -> (s0,s1), (s1,s2), (s2, s3), ..."
-    a, b = tee(iterable)
-    next(b, None)
-    return zip(a, b)
+    if isinstance(selection, sublime.Region):
+        sel.add(selection)
+    else:
+        sel.add_all(selection)